@@ -210,3 +210,26 @@ SWAGGER_SETTINGS = {
     'DEFAULT_MODEL_RENDERING': 'model',
     'DEEP_LINKING': True,
 }
+
+# Content hash used for deduplication: 'sha256' or 'blake3' (needs the blake3
+# package). Files hashed with one algorithm never match uploads hashed with
+# the other, so switching only deduplicates against files stored afterwards.
+FILE_HASH_ALGORITHM = os.environ.get('FILE_HASH_ALGORITHM', 'sha256')
+
+# Logging settings
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'files': {
+            'handlers': ['console'],
+            # Per-upload debug messages are only emitted in development
+            'level': 'DEBUG' if DEBUG else 'INFO',
+        },
+    },
+}
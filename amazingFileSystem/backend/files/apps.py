@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FilesConfig(AppConfig):
   default_auto_field = "django.db.models.BigAutoField"
   name = "files"
+
+  def ready(self):
+    from .models import validate_hash_algorithm
+    validate_hash_algorithm()
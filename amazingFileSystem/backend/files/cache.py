@@ -0,0 +1,35 @@
+from django.core.cache import cache
+from django.db import transaction
+import time
+
+# Bumped on every write; list cache keys embed it so stale entries are
+# simply never read again and expire on their own
+LIST_CACHE_VERSION_KEY = 'files:list:version'
+
+# The default LocMemCache is per process, so a write only bumps the version
+# in the worker that handled it. Keep cached lists short-lived so other
+# workers never serve stale data for longer than the page cache used to.
+LIST_CACHE_SECONDS = 30
+
+def get_list_cache_version():
+    """Current file list version; also identifies list ETags"""
+    # Seed from the clock so a version evicted from the cache restarts at a
+    # value that was never handed out, rather than reusing old keys. The
+    # finite timeout makes every worker pick up a new version eventually,
+    # even for writes it never saw, unless a shared cache backend is used.
+    cache.add(LIST_CACHE_VERSION_KEY, time.time_ns(), timeout=LIST_CACHE_SECONDS)
+    version = cache.get(LIST_CACHE_VERSION_KEY)
+    return version if version is not None else time.time_ns()
+
+def _bump_list_cache_version():
+    try:
+        cache.incr(LIST_CACHE_VERSION_KEY)
+    except ValueError:
+        # Expired; any freshly seeded value is a new version too
+        cache.add(LIST_CACHE_VERSION_KEY, time.time_ns(), timeout=LIST_CACHE_SECONDS)
+
+def invalidate_file_list_cache():
+    """Make every cached file list unreachable"""
+    # Bump only once the write is visible, or a concurrent list request
+    # could cache the old data under the new version
+    transaction.on_commit(_bump_list_cache_version)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from files.models import File
+from files.tasks import hash_file
+
+class Command(BaseCommand):
+    help = "Hash and deduplicate stored files whose background hash never ran"
+
+    def handle(self, *args, **options):
+        # Background jobs live in the worker's memory, so a restart between
+        # upload and hashing leaves the row pending until this picks it up.
+        # Safe alongside running workers: hashing a file twice is harmless.
+        pending = list(File.objects.filter(content_hash__isnull=True).values_list('pk', flat=True))
+        for file_id in pending:
+            hash_file(file_id)
+        self.stdout.write(f"Hashed {len(pending)} pending file(s)")
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.21 on 2026-10-14 17:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_file_unique_content_hash'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='file',
+            name='reference_count',
+        ),
+        migrations.RemoveField(
+            model_name='file',
+            name='storage_saved',
+        ),
+    ]
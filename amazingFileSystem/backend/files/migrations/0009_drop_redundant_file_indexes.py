@@ -0,0 +1,27 @@
+# Generated by Django 4.2.21 on 2026-10-14 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0008_remove_file_reference_count_storage_saved'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='file',
+            name='files_file_size_4a9580_idx',
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='original_filename',
+            field=models.CharField(max_length=255),
+        ),
+    ]
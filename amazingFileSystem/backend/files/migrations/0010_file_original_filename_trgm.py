@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Django compiles icontains on PostgreSQL to UPPER(col::text) LIKE UPPER(...),
+# so the trigram index has to be on that expression for the planner to use it
+CREATE_TRGM_INDEX = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS files_original_filename_trgm
+    ON files_file USING gin ((UPPER(original_filename::text)) gin_trgm_ops);
+"""
+
+DROP_TRGM_INDEX = "DROP INDEX IF EXISTS files_original_filename_trgm;"
+
+
+def create_trgm_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRGM_INDEX)
+
+
+def drop_trgm_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRGM_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_drop_redundant_file_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trgm_index, drop_trgm_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.21 on 2026-10-14 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_file_original_filename_trgm'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filereference',
+            name='reference_name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='filereference',
+            constraint=models.UniqueConstraint(fields=('original_file', 'reference_name'), name='unique_reference_name_per_file'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-14 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_filereference_unique_reference_name_per_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(max_length=72, null=True),
+        ),
+    ]
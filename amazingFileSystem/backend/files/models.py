@@ -1,13 +1,77 @@
-from django.db import models, transaction
-from django.db.models import F, Case, When
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models import F, Count
 import uuid
 import os
 import hashlib
 
+try:
+    import blake3
+except ImportError:  # Only needed when FILE_HASH_ALGORITHM = 'blake3'
+    blake3 = None
+
+# Stored hash prefix per algorithm. SHA-256 hashes stay unprefixed so rows
+# hashed before the setting existed keep matching new uploads.
+CONTENT_HASH_PREFIXES = {
+    'sha256': '',
+    'blake3': 'b3:',
+}
+
+# Read size used when hashing file content
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _hash_algorithm():
+    return getattr(settings, 'FILE_HASH_ALGORITHM', 'sha256')
+
+def validate_hash_algorithm():
+    """Fail at startup rather than on the first upload for a bad FILE_HASH_ALGORITHM"""
+    algorithm = _hash_algorithm()
+    if algorithm not in CONTENT_HASH_PREFIXES:
+        raise ImproperlyConfigured(f"Unknown FILE_HASH_ALGORITHM {algorithm!r}")
+    if algorithm == 'blake3' and blake3 is None:
+        raise ImproperlyConfigured("FILE_HASH_ALGORITHM = 'blake3' requires the blake3 package")
+
+def new_content_hasher():
+    """Hash object for the configured FILE_HASH_ALGORITHM"""
+    if _hash_algorithm() == 'blake3':
+        # Single-threaded: these hashers are fed 64KB-1MB updates, where
+        # spreading each update across threads is slower than one core
+        return blake3.blake3(max_threads=1)
+    return hashlib.sha256()
+
+def _local_path(file):
+    """Filesystem path of a file's content, if it has one"""
+    committed = getattr(file, '_committed', True)
+    if not committed:
+        # A FieldFile assigned a new upload: its path is where the upload
+        # will be stored, not where the content is now
+        file = file.file
+    if hasattr(file, 'temporary_file_path'):
+        return file.temporary_file_path()
+    if not committed:
+        return None
+    try:
+        # Stored FieldFiles on local storage
+        return file.path
+    except (AttributeError, NotImplementedError, ValueError):
+        return None
+
+def format_content_hash(hasher):
+    """Stored content_hash value for a finished hash object"""
+    return CONTENT_HASH_PREFIXES[_hash_algorithm()] + hasher.hexdigest()
+
 def calculate_file_hash(file):
-    """Calculate SHA-256 hash of file content"""
-    sha256_hash = hashlib.sha256()
-    
+    """Calculate the content hash of a file with FILE_HASH_ALGORITHM"""
+    if _hash_algorithm() == 'blake3':
+        path = _local_path(file)
+        if path:
+            # Hashing the whole mapped file at once is where BLAKE3's
+            # multithreading pays off
+            hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+            hasher.update_mmap(path)
+            return format_content_hash(hasher)
+
     # Store original position
     original_pos = file.tell()
     
@@ -15,22 +79,39 @@ def calculate_file_hash(file):
         # Reset to beginning of file
         file.seek(0)
         
-        if hasattr(file, 'chunks'):
+        # UploadedFile objects wrap the real stream in .file; hashing that
+        # directly lets file_digest readinto its own buffer
+        stream = getattr(file, 'file', file)
+        
+        if hasattr(hashlib, 'file_digest') and hasattr(stream, 'readinto'):
+            # Python 3.11+: the whole read/update loop runs in C
+            return format_content_hash(hashlib.file_digest(stream, new_content_hasher))
+        
+        hasher = new_content_hasher()
+        if hasattr(stream, 'readinto'):
+            # Read into one preallocated buffer instead of a new bytes per chunk
+            buf = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buf)
+            while True:
+                n = stream.readinto(buf)
+                if not n:
+                    break
+                hasher.update(view[:n])
+        elif hasattr(file, 'chunks'):
             # For UploadedFile objects
-            for chunk in file.chunks():
-                sha256_hash.update(chunk)
+            for chunk in file.chunks(chunk_size=HASH_CHUNK_SIZE):
+                hasher.update(chunk)
         else:
             # For regular file objects
             while True:
-                chunk = file.read(4096)
+                chunk = file.read(HASH_CHUNK_SIZE)
                 if not chunk:
                     break
-                sha256_hash.update(chunk)
+                hasher.update(chunk)
+        return format_content_hash(hasher)
     finally:
         # Restore original position
         file.seek(original_pos)
-    
-    return sha256_hash.hexdigest()
 
 def file_upload_path(instance, filename):
     """Generate file path for new file upload"""
@@ -42,26 +123,32 @@ def generate_default_hash():
     """Generate a default hash for existing records"""
     return hashlib.sha256(b'default').hexdigest()
 
+class FileQuerySet(models.QuerySet):
+    def with_reference_stats(self):
+        """Annotate reference_count and storage_saved from the references table"""
+        return self.annotate(
+            reference_count=Count('references') + 1,
+            storage_saved=F('size') * Count('references'),
+        )
+
 class File(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.FileField(upload_to=file_upload_path)
-    original_filename = models.CharField(max_length=255, db_index=True)
+    original_filename = models.CharField(max_length=255)  # Indexed by (original_filename, file_type)
     file_type = models.CharField(max_length=100, db_index=True)
     size = models.BigIntegerField(db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True, db_index=True)
     content_hash = models.CharField(
-        max_length=64,
-        db_index=True,
+        max_length=72,  # Hex digest plus an optional algorithm prefix
         null=True,  # Allow null initially
-    )
-    reference_count = models.PositiveIntegerField(default=1)  # Track number of references
-    storage_saved = models.BigIntegerField(default=0)  # Track storage saved by deduplication
+    )  # Indexed by (content_hash, size) and the unique constraint
+
+    objects = FileQuerySet.as_manager()
     
     class Meta:
         ordering = ['-uploaded_at']
         indexes = [
             models.Index(fields=['original_filename', 'file_type']),
-            models.Index(fields=['size', 'uploaded_at']),
             models.Index(fields=['content_hash', 'size']),
         ]
         constraints = [
@@ -75,67 +162,28 @@ class File(models.Model):
     def __str__(self):
         return self.original_filename
 
-    def save(self, *args, update_fields=None, **kwargs):
-        # Calculate hash if not already set
-        if not self.content_hash and self.file:
+    def save(self, *args, hash_content=True, **kwargs):
+        # Calculate hash if not already set, unless it will be done later
+        if hash_content and not self.content_hash and self.file:
             self.content_hash = calculate_file_hash(self.file)
-        
-        # Calculate storage saved
-        if self.reference_count > 1:
-            # Storage saved is the size of the file times the number of references minus 1
-            # (minus 1 because the original file is not counted as saving space)
-            self.storage_saved = self.size * (self.reference_count - 1)
-        else:
-            self.storage_saved = 0
-            
-        super().save(*args, update_fields=update_fields, **kwargs)
-
-    @transaction.atomic
-    def update_reference_count(self, change):
-        """Update reference count and storage saved atomically"""
-        # Get current reference count to prevent going below 1
-        current_count = File.objects.filter(pk=self.pk).values('reference_count')[0]['reference_count']
-        new_count = current_count + change
-        
-        # Ensure reference count never goes below 1
-        if new_count < 1:
-            new_count = 1
-            
-        # Update using the calculated new count
-        File.objects.filter(pk=self.pk).update(
-            reference_count=new_count,
-            storage_saved=Case(
-                When(reference_count__gt=1, 
-                     then=F('size') * (new_count - 1)),
-                default=0,
-                output_field=models.BigIntegerField()
-            )
-        )
-        # Refresh from db to get updated values
-        self.refresh_from_db()
+        super().save(*args, **kwargs)
 
 class FileReference(models.Model):
     """Model to store references to existing files"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     original_file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='references')
-    reference_name = models.CharField(max_length=255, unique=True)  # The name used for this reference
+    reference_name = models.CharField(max_length=255)  # The name used for this reference
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            # The same name may reference different files, but only once per file
+            models.UniqueConstraint(
+                fields=['original_file', 'reference_name'],
+                name='unique_reference_name_per_file'
+            )
+        ]
     
     def __str__(self):
         return f"{self.reference_name} -> {self.original_file.original_filename}"
-
-    @transaction.atomic
-    def save(self, *args, **kwargs):
-        # Increment reference count when creating a new reference
-        if not self.pk:  # Only on creation
-            self.original_file.update_reference_count(1)
-        super().save(*args, **kwargs)
-
-    @transaction.atomic
-    def delete(self, *args, **kwargs):
-        # Decrement reference count when deleting a reference
-        self.original_file.update_reference_count(-1)
-        super().delete(*args, **kwargs) 
\ No newline at end of file
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from .models import File, FileReference
 
+STORAGE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
 class FileSerializer(serializers.ModelSerializer):
     reference_count = serializers.IntegerField(read_only=True)
     storage_saved = serializers.IntegerField(read_only=True)
@@ -8,12 +10,12 @@ class FileSerializer(serializers.ModelSerializer):
     
     def get_storage_saved_formatted(self, obj):
         """Return human-readable storage saved"""
-        bytes = obj.storage_saved
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if bytes < 1024:
-                return f"{bytes:.2f} {unit}"
-            bytes /= 1024
-        return f"{bytes:.2f} PB"
+        n = obj.storage_saved
+        if n <= 0:
+            return "0.00 B"
+        # Each unit is 2**10 of the previous, so the bit length picks it directly
+        i = min(len(STORAGE_UNITS) - 1, (n.bit_length() - 1) // 10)
+        return f"{n / (1 << (10 * i)):.2f} {STORAGE_UNITS[i]}"
     
     class Meta:
         model = File
@@ -22,6 +24,14 @@ class FileSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'uploaded_at', 'content_hash', 'reference_count', 
                            'storage_saved', 'storage_saved_formatted']
 
+class FileListSerializer(FileSerializer):
+    """File serializer for list pages, without the per-row formatted size"""
+    storage_saved_formatted = None
+
+    class Meta(FileSerializer.Meta):
+        fields = [f for f in FileSerializer.Meta.fields if f != 'storage_saved_formatted']
+        read_only_fields = [f for f in FileSerializer.Meta.read_only_fields if f != 'storage_saved_formatted']
+
 class FileReferenceSerializer(serializers.ModelSerializer):
     original_file = FileSerializer(read_only=True)
     
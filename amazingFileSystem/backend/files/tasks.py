@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction, IntegrityError, close_old_connections
+from .models import File, FileReference, calculate_file_hash
+from .cache import invalidate_file_list_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Hashing runs off the request thread so large uploads don't hold a worker
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='file-hash')
+
+def enqueue_file_hash(file_id):
+    """Hash and deduplicate a stored file in the background once the upload commits"""
+    transaction.on_commit(lambda: _executor.submit(hash_file, file_id))
+
+def hash_file(file_id):
+    """
+    Compute the content hash of a stored file. If another file with the same
+    content already won the hash, turn this upload into a reference to it.
+    """
+    close_old_connections()
+    try:
+        _hash_file(file_id)
+    except Exception:
+        # Nothing reads the executor's future, so this is the only trace
+        logger.exception("Background hashing failed - File: %s", file_id)
+    finally:
+        close_old_connections()
+
+def _hash_file(file_id):
+    instance = File.objects.filter(pk=file_id, content_hash__isnull=True).first()
+    if not instance:
+        return
+
+    with instance.file.open('rb') as f:
+        content_hash = calculate_file_hash(f)
+
+    try:
+        with transaction.atomic():
+            File.objects.filter(pk=file_id, content_hash__isnull=True).update(content_hash=content_hash)
+    except IntegrityError:
+        # Same content already stored: keep the existing blob
+        _replace_with_reference(file_id, content_hash)
+
+    invalidate_file_list_cache()
+
+def _replace_with_reference(file_id, content_hash):
+    with transaction.atomic():
+        # Lock the upload so a delete that lands now can't be undone by
+        # turning the deleted upload into a reference
+        pending = File.objects.select_for_update().filter(
+            pk=file_id, content_hash__isnull=True
+        ).first()
+        if not pending:
+            return
+
+        existing = File.objects.only('id').filter(content_hash=content_hash).first()
+        if not existing:
+            # The winning file was deleted meanwhile; this upload takes its place
+            File.objects.filter(pk=file_id).update(content_hash=content_hash)
+            return
+
+        try:
+            with transaction.atomic():
+                FileReference.objects.create(
+                    original_file=existing,
+                    reference_name=pending.original_filename
+                )
+        except IntegrityError:
+            # Already referenced under this name, so nothing new is kept,
+            # as with the 409 from a synchronous upload
+            logger.info("Dropping duplicate upload - Name: %s, Hash: %s", pending.original_filename, content_hash)
+
+        pending.delete()
+        transaction.on_commit(lambda: pending.file.delete(save=False))
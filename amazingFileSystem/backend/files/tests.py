@@ -0,0 +1,149 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from . import tasks
+from .models import File, FileReference, blake3, calculate_file_hash
+
+class HashFileTaskTests(TestCase):
+    """Background hashing of uploads stored with content_hash NULL"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def store(self, name, content, hashed=True):
+        instance = File(original_filename=name, file_type='text/plain', size=len(content))
+        instance.file.save(name, ContentFile(content), save=False)
+        instance.save(hash_content=hashed)
+        return instance
+
+    def hash_file(self, file_id):
+        # hash_file logs and swallows errors, so fail on any it logged
+        with self.assertNoLogs('files.tasks', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            tasks.hash_file(file_id)
+
+    def test_unique_content_is_hashed(self):
+        pending = self.store('a.txt', b'alpha', hashed=False)
+        self.hash_file(pending.pk)
+        pending.refresh_from_db()
+        self.assertEqual(pending.content_hash, hashlib.sha256(b'alpha').hexdigest())
+
+    def test_duplicate_becomes_reference(self):
+        winner = self.store('a.txt', b'alpha')
+        pending = self.store('b.txt', b'alpha', hashed=False)
+        self.hash_file(pending.pk)
+        self.assertFalse(File.objects.filter(pk=pending.pk).exists())
+        self.assertFalse(pending.file.storage.exists(pending.file.name))
+        self.assertQuerysetEqual(
+            FileReference.objects.filter(original_file=winner).values_list('reference_name', flat=True),
+            ['b.txt']
+        )
+
+    def test_winner_deleted_keeps_upload(self):
+        winner = self.store('a.txt', b'alpha')
+        pending = self.store('b.txt', b'alpha', hashed=False)
+        content_hash = winner.content_hash
+        winner.delete()
+        tasks._replace_with_reference(pending.pk, content_hash)
+        pending.refresh_from_db()
+        self.assertEqual(pending.content_hash, content_hash)
+        self.assertFalse(FileReference.objects.exists())
+
+    def test_taken_reference_name_drops_upload(self):
+        winner = self.store('a.txt', b'alpha')
+        FileReference.objects.create(original_file=winner, reference_name='b.txt')
+        pending = self.store('b.txt', b'alpha', hashed=False)
+        self.hash_file(pending.pk)
+        self.assertFalse(File.objects.filter(pk=pending.pk).exists())
+        self.assertFalse(pending.file.storage.exists(pending.file.name))
+        self.assertEqual(FileReference.objects.filter(original_file=winner).count(), 1)
+
+    def test_upload_deleted_while_hashing(self):
+        winner = self.store('a.txt', b'alpha')
+        pending = self.store('b.txt', b'alpha', hashed=False)
+
+        def delete_then_hash(f):
+            File.objects.filter(pk=pending.pk).delete()
+            return winner.content_hash
+
+        with mock.patch.object(tasks, 'calculate_file_hash', side_effect=delete_then_hash):
+            self.hash_file(pending.pk)
+        self.assertFalse(File.objects.filter(pk=pending.pk).exists())
+        self.assertFalse(FileReference.objects.exists())
+
+    def test_command_hashes_pending_files(self):
+        pending = self.store('a.txt', b'alpha', hashed=False)
+        call_command('hash_pending_files', stdout=io.StringIO())
+        pending.refresh_from_db()
+        self.assertEqual(pending.content_hash, hashlib.sha256(b'alpha').hexdigest())
+
+class FileListETagTests(TestCase):
+    """Conditional and cached file list requests"""
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        File.objects.create(
+            original_filename='a.txt', file_type='text/plain', size=5,
+            file='uploads/a.txt', content_hash=hashlib.sha256(b'alpha').hexdigest()
+        )
+
+    def test_cached_list_runs_one_query(self):
+        etag = self.client.get('/api/files/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/files/')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/files/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+@skipUnless(blake3, "blake3 is not installed")
+class Blake3HashTests(TestCase):
+    """FILE_HASH_ALGORITHM = 'blake3', which hashes local files by path"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, FILE_HASH_ALGORITHM='blake3')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_uncommitted_field_file_hashes_its_upload(self):
+        # Something already sits where the new upload would be stored
+        with open(os.path.join(self.media_root, 'new.txt'), 'wb') as f:
+            f.write(b'decoy')
+        instance = File(original_filename='new.txt', file_type='text/plain', size=5)
+        instance.file = SimpleUploadedFile('new.txt', b'alpha')
+        self.assertEqual(calculate_file_hash(instance.file), 'b3:' + blake3.blake3(b'alpha').hexdigest())
+
+    def test_replace_pending_file_content(self):
+        instance = File(original_filename='a.txt', file_type='text/plain', size=5)
+        instance.file.save('a.txt', ContentFile(b'alpha'), save=False)
+        instance.save(hash_content=False)
+
+        response = self.client.put(
+            f'/api/files/{instance.pk}/',
+            encode_multipart(BOUNDARY, {
+                'file': SimpleUploadedFile('new.txt', b'bravo'),
+                'original_filename': 'new.txt',
+                'file_type': 'text/plain',
+                'size': 5,
+            }),
+            content_type=MULTIPART_CONTENT,
+        )
+        self.assertEqual(response.status_code, 200)
+        instance.refresh_from_db()
+        self.assertEqual(instance.content_hash, 'b3:' + blake3.blake3(b'bravo').hexdigest())
@@ -1,8 +1,8 @@
 from django.urls import path, include
-from rest_framework.routers import DefaultRouter
+from rest_framework.routers import SimpleRouter
 from .views import FileViewSet, FileReferenceViewSet
 
-router = DefaultRouter()
+router = SimpleRouter()
 router.register(r'files', FileViewSet, basename='file')
 router.register(r'references', FileReferenceViewSet, basename='reference')
 
@@ -1,22 +1,70 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status, filters, mixins
 from rest_framework.response import Response
+from rest_framework.generics import get_object_or_404
 from django_filters import rest_framework as django_filters
 from .models import File, FileReference, calculate_file_hash
-from .serializers import FileSerializer, FileReferenceSerializer
+from .serializers import FileSerializer, FileListSerializer, FileReferenceSerializer
+from .cache import LIST_CACHE_SECONDS, get_list_cache_version, invalidate_file_list_cache
+from .tasks import enqueue_file_hash
 from django.core.files.base import ContentFile
-from django.db.models import Q, F
+from django.db.models import Q, F, Count, Max, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.core.cache import cache
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
+from django.views.decorators.http import etag
+from django.utils.cache import patch_cache_control
 from django.conf import settings
+from django.http import Http404
 from datetime import datetime, timedelta
 from django.db import transaction, IntegrityError
 from drf_yasg.utils import swagger_auto_schema, swagger_serializer_method
 from drf_yasg import openapi
 import io
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Uploads above this size are stored unhashed and hashed in the background
+BACKGROUND_HASH_THRESHOLD = 50 * 1024 * 1024
 
 # Create response schemas for Swagger
+# Fields shared by every serialized file and reference
+file_fields_schema = {
+    'id': openapi.Schema(type=openapi.TYPE_STRING),
+    'file': openapi.Schema(type=openapi.TYPE_STRING),
+    'original_filename': openapi.Schema(type=openapi.TYPE_STRING),
+    'file_type': openapi.Schema(type=openapi.TYPE_STRING),
+    'size': openapi.Schema(type=openapi.TYPE_INTEGER),
+    'uploaded_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
+    'reference_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+    'storage_saved': openapi.Schema(type=openapi.TYPE_INTEGER),
+}
+
+reference_fields_schema = {
+    'id': openapi.Schema(type=openapi.TYPE_STRING),
+    'reference_name': openapi.Schema(type=openapi.TYPE_STRING),
+    'created_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
+    'original_file': openapi.Schema(type=openapi.TYPE_STRING),
+}
+
+def paginated_schema(item_properties):
+    """Schema for a LimitOffsetPagination page of objects"""
+    return openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'count': openapi.Schema(type=openapi.TYPE_INTEGER),
+            'next': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+            'previous': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
+            'results': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_OBJECT, properties=item_properties)
+            )
+        }
+    )
+
 file_upload_response = openapi.Schema(
     type=openapi.TYPE_OBJECT,
     properties={
@@ -25,29 +73,64 @@ file_upload_response = openapi.Schema(
         'file': openapi.Schema(
             type=openapi.TYPE_OBJECT,
             properties={
-                'id': openapi.Schema(type=openapi.TYPE_STRING),
-                'file': openapi.Schema(type=openapi.TYPE_STRING),
-                'original_filename': openapi.Schema(type=openapi.TYPE_STRING),
-                'file_type': openapi.Schema(type=openapi.TYPE_STRING),
-                'size': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'uploaded_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
-                'reference_count': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'storage_saved': openapi.Schema(type=openapi.TYPE_INTEGER),
+                **file_fields_schema,
                 'storage_saved_formatted': openapi.Schema(type=openapi.TYPE_STRING),
             }
         ),
-        'reference': openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'id': openapi.Schema(type=openapi.TYPE_STRING),
-                'reference_name': openapi.Schema(type=openapi.TYPE_STRING),
-                'created_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
-                'original_file': openapi.Schema(type=openapi.TYPE_STRING),
-            }
-        ),
+        'reference': openapi.Schema(type=openapi.TYPE_OBJECT, properties=reference_fields_schema),
     }
 )
 
+file_list_response = paginated_schema(file_fields_schema)
+
+reference_list_response = paginated_schema(reference_fields_schema)
+
+def _table_aggregate(queryset, aggregate):
+    """Scalar subquery computing one aggregate over a whole queryset"""
+    return Subquery(
+        queryset.order_by().annotate(_all=Value(1)).values('_all').annotate(value=aggregate).values('value')
+    )
+
+def file_list_etag(request, *args, **kwargs):
+    """
+    ETag for a file list page, computed once per request. The cache version
+    only changes in the worker that handled a write, so the tag also folds in
+    database state that any write changes, wherever it came from.
+
+    The version also expires after LIST_CACHE_SECONDS and is per worker, so
+    tags rotate at that interval even without writes and differ between
+    workers; clients just get a 200 instead of a 304 in those cases.
+    """
+    if hasattr(request, '_file_list_etag'):
+        return request._file_list_etag
+
+    # One query: there are no references without files, so an empty
+    # files table (no row) means there is nothing to describe
+    state = File.objects.order_by().values(
+        latest=_table_aggregate(File.objects, Max('uploaded_at')),
+        count=_table_aggregate(File.objects, Count('id')),
+        # Background hashing fills in content_hash without adding rows
+        pending=_table_aggregate(File.objects.filter(content_hash__isnull=True), Count('id')),
+        references_latest=_table_aggregate(FileReference.objects, Max('created_at')),
+        references_count=_table_aggregate(FileReference.objects, Count('id')),
+    )[:1]
+    state = f"{list(state)}:{request.build_absolute_uri()}"
+    state_hash = hashlib.md5(state.encode(), usedforsecurity=False).hexdigest()
+    request._file_list_etag = f"{get_list_cache_version()}-{state_hash}"
+    return request._file_list_etag
+
+class NoPageCacheMixin:
+    """
+    Keep the site-wide cache middleware off an API endpoint. Its entries
+    can't be invalidated per key, so writes would go unseen for up to
+    CACHE_MIDDLEWARE_SECONDS; the file list has its own versioned cache.
+    """
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            patch_cache_control(response, max_age=0)
+        return response
+
 class FileFilter(django_filters.FilterSet):
     filename = django_filters.CharFilter(field_name='original_filename', lookup_expr='icontains')
     min_size = django_filters.NumberFilter(field_name='size', lookup_expr='gte')
@@ -60,13 +143,13 @@ class FileFilter(django_filters.FilterSet):
         model = File
         fields = ['filename', 'file_type', 'min_size', 'max_size', 'upload_date_after', 'upload_date_before']
 
-class FileViewSet(viewsets.ModelViewSet):
+class FileViewSet(NoPageCacheMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing files.
     """
-    queryset = File.objects.all().select_related()
+    queryset = File.objects.all()
     serializer_class = FileSerializer
-    filter_backends = [django_filters.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = (django_filters.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter)
     filterset_class = FileFilter
     search_fields = ['original_filename', 'file_type']
     ordering_fields = ['original_filename', 'size', 'uploaded_at']
@@ -74,24 +157,54 @@ class FileViewSet(viewsets.ModelViewSet):
 
     def _invalidate_cache(self):
         """Helper method to invalidate cache"""
-        cache.clear()  # Simply clear all cache instead of pattern matching
+        invalidate_file_list_cache()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self._invalidate_cache()
+
+    def _list_cache_key(self, request):
+        """Cache key for a list request under the current cache version"""
+        return f"files:list:{file_list_etag(request)}"
+
+    def get_object(self):
+        if self.request.method != 'DELETE':
+            return super().get_object()
+        
+        # Deletes lock the row and count its references in one query. A
+        # subquery rather than Count() since FOR UPDATE can't be combined
+        # with GROUP BY.
+        ref_count = FileReference.objects.filter(
+            original_file=OuterRef('pk')
+        ).order_by().values('original_file').annotate(n=Count('pk')).values('n')
+        queryset = File.objects.only('id').annotate(
+            _ref_count=Coalesce(Subquery(ref_count), 0)
+        ).select_for_update()
+        
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return FileListSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         """
         Optimize queryset based on filter parameters
         """
         # Don't use cache for the queryset to ensure fresh data
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().with_reference_stats()
         
-        # Get filter parameters
-        filename = self.request.query_params.get('filename')
+        # Get filter parameters. The filename substring match is left to
+        # FileFilter so the LIKE isn't evaluated twice.
         file_type = self.request.query_params.get('file_type')
         min_size = self.request.query_params.get('min_size')
         max_size = self.request.query_params.get('max_size')
         
         # Apply optimized filtering
-        if filename:
-            queryset = queryset.filter(original_filename__icontains=filename)
         if file_type:
             queryset = queryset.filter(file_type=file_type)
         if min_size:
@@ -114,36 +227,20 @@ class FileViewSet(viewsets.ModelViewSet):
         responses={
             200: openapi.Response(
                 description="List of files",
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'count': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'next': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'previous': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'results': openapi.Schema(
-                            type=openapi.TYPE_ARRAY,
-                            items=openapi.Schema(
-                                type=openapi.TYPE_OBJECT,
-                                properties={
-                                    'id': openapi.Schema(type=openapi.TYPE_STRING),
-                                    'file': openapi.Schema(type=openapi.TYPE_STRING),
-                                    'original_filename': openapi.Schema(type=openapi.TYPE_STRING),
-                                    'file_type': openapi.Schema(type=openapi.TYPE_STRING),
-                                    'size': openapi.Schema(type=openapi.TYPE_INTEGER),
-                                    'uploaded_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
-                                    'reference_count': openapi.Schema(type=openapi.TYPE_INTEGER),
-                                    'storage_saved': openapi.Schema(type=openapi.TYPE_INTEGER),
-                                    'storage_saved_formatted': openapi.Schema(type=openapi.TYPE_STRING),
-                                }
-                            )
-                        )
-                    }
-                )
+                schema=file_list_response
             )
         }
     )
+    @method_decorator(etag(file_list_etag))
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        cache_key = self._list_cache_key(request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        cache.set(cache_key, response.data, LIST_CACHE_SECONDS)
+        return response
 
     @swagger_auto_schema(
         operation_description="Upload a new file",
@@ -156,6 +253,7 @@ class FileViewSet(viewsets.ModelViewSet):
         ),
         responses={
             201: openapi.Response(description="File uploaded successfully", schema=file_upload_response),
+            202: openapi.Response(description="Large file stored, deduplication pending", schema=file_upload_response),
             400: "Bad request",
             409: "Duplicate file"
         }
@@ -170,35 +268,22 @@ class FileViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            if file_obj.size > BACKGROUND_HASH_THRESHOLD:
+                return self._create_pending(file_obj)
+
             # Calculate file hash
             content_hash = calculate_file_hash(file_obj)
             
             # Debug logging
-            print(f"File upload attempt - Name: {file_obj.name}, Size: {file_obj.size}, Hash: {content_hash}")
+            logger.debug("File upload attempt - Name: %s, Size: %s, Hash: %s", file_obj.name, file_obj.size, content_hash)
             
             # Check for exact duplicate (same hash AND size)
-            existing_file = File.objects.filter(content_hash=content_hash).first()
+            # Only the id and name are needed to create the reference
+            existing_file = File.objects.filter(content_hash=content_hash).only('id', 'original_filename').first()
             
             if existing_file:
-                print(f"Duplicate found - Existing file: {existing_file.original_filename}, Hash: {existing_file.content_hash}")
-                # Create a file reference instead of rejecting the upload
-                try:
-                    reference = FileReference.objects.create(
-                        original_file=existing_file,
-                        reference_name=file_obj.name
-                    )
-                    return Response({
-                        'message': f'File content already exists as {existing_file.original_filename}. Created a reference instead.',
-                        'type': 'reference',
-                        'reference': FileReferenceSerializer(reference).data
-                    }, status=status.HTTP_201_CREATED)
-                except Exception as e:
-                    print(f"Error creating reference: {str(e)}")
-                    return Response({
-                        'error': 'Duplicate file',
-                        'message': f'This file appears to be identical to {existing_file.original_filename}',
-                        'type': 'duplicate',
-                    }, status=status.HTTP_409_CONFLICT)
+                logger.debug("Duplicate found - Existing file: %s, Hash: %s", existing_file.original_filename, content_hash)
+                return self._create_reference(file_obj, existing_file)
             
             # Create new file
             serializer = self.get_serializer(data={
@@ -210,10 +295,19 @@ class FileViewSet(viewsets.ModelViewSet):
             })
             
             serializer.is_valid(raise_exception=True)
-            self.perform_create(serializer)
+            # content_hash is read-only on the serializer, set it explicitly
+            # so the model doesn't hash the file a second time
+            instance = File(**serializer.validated_data, content_hash=content_hash)
+            if not self._insert_file(instance):
+                return self._create_reference_to_winner(file_obj, content_hash)
             self._invalidate_cache()
             
-            print(f"File uploaded successfully - Name: {file_obj.name}, Hash: {content_hash}")
+            # Re-read through the annotated queryset for reference stats
+            serializer = self.get_serializer(
+                File.objects.with_reference_stats().get(pk=instance.pk)
+            )
+            
+            logger.debug("File uploaded successfully - Name: %s, Hash: %s", file_obj.name, content_hash)
             
             headers = self.get_success_headers(serializer.data)
             return Response({
@@ -222,23 +316,89 @@ class FileViewSet(viewsets.ModelViewSet):
                 'file': serializer.data
             }, status=status.HTTP_201_CREATED, headers=headers)
             
-        except IntegrityError as e:
-            print(f"IntegrityError during upload - Name: {file_obj.name}, Error: {str(e)}")
-            # Try to find the existing file to provide better error message
-            existing = File.objects.filter(content_hash=content_hash).first()
-            message = f'A file with the same content already exists: {existing.original_filename}' if existing else 'A file with the same content already exists.'
-            return Response({
-                'error': 'Duplicate file',
-                'message': message,
-                'type': 'duplicate',
-            }, status=status.HTTP_409_CONFLICT)
         except Exception as e:
-            print(f"Error during upload - Name: {file_obj.name}, Error: {str(e)}")
+            logger.exception("Error during upload - Name: %s", file_obj.name)
             return Response({
                 'error': 'Upload failed',
                 'message': str(e) if settings.DEBUG else 'An error occurred while uploading the file. Please try again.'
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def _insert_file(self, instance):
+        """
+        Insert a new file, returning False if a concurrent upload stored the
+        same content first. The duplicate blob is removed in that case.
+        """
+        try:
+            # Savepoint so the unique constraint violation doesn't break the
+            # outer transaction
+            with transaction.atomic():
+                instance.save()
+        except IntegrityError:
+            instance.file.delete(save=False)
+            return False
+        return True
+
+    def _create_reference_to_winner(self, file_obj, content_hash):
+        """
+        Reference the file that won the race to store this content.
+        """
+        existing_file = File.objects.only('id', 'original_filename').get(content_hash=content_hash)
+        logger.debug("Duplicate stored concurrently - Existing file: %s, Hash: %s", existing_file.original_filename, content_hash)
+        return self._create_reference(file_obj, existing_file)
+
+    def _create_reference(self, file_obj, existing_file):
+        """
+        Create a reference to an existing file instead of storing the upload again.
+        """
+        try:
+            reference = FileReference.objects.create(
+                original_file=existing_file,
+                reference_name=file_obj.name
+            )
+            reference.original_file = File.objects.with_reference_stats().get(pk=existing_file.pk)
+            # The original's reference stats changed
+            self._invalidate_cache()
+            return Response({
+                'message': f'File content already exists as {existing_file.original_filename}. Created a reference instead.',
+                'type': 'reference',
+                'reference': FileReferenceSerializer(reference).data
+            }, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            logger.warning("Error creating reference: %s", e)
+            return Response({
+                'error': 'Duplicate file',
+                'message': f'This file appears to be identical to {existing_file.original_filename}',
+                'type': 'duplicate',
+            }, status=status.HTTP_409_CONFLICT)
+
+    def _create_pending(self, file_obj):
+        """
+        Store a new file without a hash and deduplicate it in the background.
+        """
+        # content_hash stays NULL until the task sets it; the unique
+        # constraint only applies to non-null hashes
+        instance = File(
+            file=file_obj,
+            original_filename=file_obj.name,
+            file_type=file_obj.content_type,
+            size=file_obj.size,
+        )
+        instance.save(hash_content=False)
+        enqueue_file_hash(instance.pk)
+        self._invalidate_cache()
+
+        logger.debug("File stored, hashing in background - Name: %s", file_obj.name)
+
+        serializer = self.get_serializer(
+            File.objects.with_reference_stats().get(pk=instance.pk)
+        )
+        headers = self.get_success_headers(serializer.data)
+        return Response({
+            'message': 'File uploaded successfully. Duplicate detection is still in progress.',
+            'type': 'original',
+            'file': serializer.data
+        }, status=status.HTTP_202_ACCEPTED, headers=headers)
+
     @swagger_auto_schema(
         operation_description="Delete a file",
         responses={
@@ -247,35 +407,31 @@ class FileViewSet(viewsets.ModelViewSet):
             409: "Cannot delete file with references"
         }
     )
-    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         """
         Delete a file. Cannot delete files that have references.
         """
-        instance = self.get_object()
-        
         try:
-            # Use select_for_update to prevent race conditions
-            instance = File.objects.filter(pk=instance.pk).select_for_update().get()
-            
-            # Get the actual count of references
-            reference_count = instance.references.count()
-            
-            if reference_count > 0:
-                return Response({
-                    'error': 'Cannot delete',
-                    'message': f'This file has {reference_count} references. Delete the references first.',
-                }, status=status.HTTP_409_CONFLICT)
-            
-            # If we get here, there are no references, so we can delete
-            self.perform_destroy(instance)
+            # Hold the row lock only for the check and the delete itself
+            with transaction.atomic():
+                instance = self.get_object()
+                reference_count = instance._ref_count
+                
+                if reference_count > 0:
+                    return Response({
+                        'error': 'Cannot delete',
+                        'message': f'This file has {reference_count} references. Delete the references first.',
+                    }, status=status.HTTP_409_CONFLICT)
+                
+                # If we get here, there are no references, so we can delete
+                self.perform_destroy(instance)
             
             # Clear cache after deletion
             self._invalidate_cache()
             
             return Response(status=status.HTTP_204_NO_CONTENT)
             
-        except File.DoesNotExist:
+        except Http404:
             return Response({
                 'error': 'Not found',
                 'message': 'The file no longer exists.',
@@ -286,15 +442,24 @@ class FileViewSet(viewsets.ModelViewSet):
                 'message': str(e) if settings.DEBUG else 'Failed to delete the file.',
             }, status=status.HTTP_400_BAD_REQUEST)
 
-class FileReferenceViewSet(mixins.ListModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+class FileReferenceViewSet(NoPageCacheMixin, mixins.ListModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     """
     API endpoint for managing file references.
     """
     queryset = FileReference.objects.all()
     serializer_class = FileReferenceSerializer
-    filter_backends = [django_filters.DjangoFilterBackend]
+    filter_backends = (django_filters.DjangoFilterBackend,)
     filterset_fields = ['original_file']
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Only the list serializes the original file; a delete just needs the row
+        if self.action == 'list':
+            queryset = queryset.prefetch_related(
+                Prefetch('original_file', queryset=File.objects.with_reference_stats())
+            )
+        return queryset
+
     @swagger_auto_schema(
         operation_description="List references for a file",
         manual_parameters=[
@@ -303,26 +468,7 @@ class FileReferenceViewSet(mixins.ListModelMixin, mixins.DestroyModelMixin, view
         responses={
             200: openapi.Response(
                 description="List of references",
-                schema=openapi.Schema(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'count': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'next': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'previous': openapi.Schema(type=openapi.TYPE_STRING, nullable=True),
-                        'results': openapi.Schema(
-                            type=openapi.TYPE_ARRAY,
-                            items=openapi.Schema(
-                                type=openapi.TYPE_OBJECT,
-                                properties={
-                                    'id': openapi.Schema(type=openapi.TYPE_STRING),
-                                    'reference_name': openapi.Schema(type=openapi.TYPE_STRING),
-                                    'created_at': openapi.Schema(type=openapi.TYPE_STRING, format='date-time'),
-                                    'original_file': openapi.Schema(type=openapi.TYPE_STRING),
-                                }
-                            )
-                        )
-                    }
-                )
+                schema=reference_list_response
             )
         }
     )
@@ -340,4 +486,9 @@ class FileReferenceViewSet(mixins.ListModelMixin, mixins.DestroyModelMixin, view
         """
         Delete a file reference.
         """
-        return super().destroy(request, *args, **kwargs)
\ No newline at end of file
+        return super().destroy(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        # The original's reference stats changed
+        invalidate_file_list_cache()
\ No newline at end of file
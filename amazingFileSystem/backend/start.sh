@@ -9,6 +9,10 @@ echo "Running migrations..."
 python manage.py makemigrations
 python manage.py migrate
 
+# Finish background hashing lost to a restart
+echo "Hashing pending files..."
+python manage.py hash_pending_files
+
 # Start server
 echo "Starting server..."
 gunicorn --bind 0.0.0.0:8000 core.wsgi:application 
\ No newline at end of file
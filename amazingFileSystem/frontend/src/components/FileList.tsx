@@ -6,6 +6,15 @@ import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import StorageSavings from './StorageSavings';
 import SearchAndFilter, { FilterParams } from './SearchAndFilter';
 
+// Format a byte count for display
+const formatBytes = (bytes: number): string => {
+  if (bytes === 0) return '0 B';
+  const k = 1024;
+  const sizes = ['B', 'KB', 'MB', 'GB', 'TB'];
+  const i = Math.floor(Math.log(bytes) / Math.log(k));
+  return `${parseFloat((bytes / Math.pow(k, i)).toFixed(2))} ${sizes[i]}`;
+};
+
 export const FileList: React.FC = () => {
   const queryClient = useQueryClient();
   const [filters, setFilters] = useState<FilterParams>({});
@@ -124,15 +133,6 @@ export const FileList: React.FC = () => {
     // Calculate savings percentage
     const savingsPercentage = totalSize > 0 ? (totalSaved / totalSize) * 100 : 0;
     
-    // Format the total saved storage
-    const formatBytes = (bytes: number): string => {
-      if (bytes === 0) return '0 B';
-      const k = 1024;
-      const sizes = ['B', 'KB', 'MB', 'GB', 'TB'];
-      const i = Math.floor(Math.log(bytes) / Math.log(k));
-      return `${parseFloat((bytes / Math.pow(k, i)).toFixed(2))} ${sizes[i]}`;
-    };
-
     return {
       totalFiles,
       totalSize,
@@ -277,7 +277,7 @@ export const FileList: React.FC = () => {
                       <p className="text-sm text-gray-500">
                         {file.file_type} • {(file.size / 1024).toFixed(2)} KB
                         {file.reference_count > 1 && ` • ${file.reference_count} references`}
-                        {file.storage_saved > 0 && ` • Saving ${file.storage_saved_formatted}`}
+                        {file.storage_saved > 0 && ` • Saving ${formatBytes(file.storage_saved)}`}
                       </p>
                       <p className="text-sm text-gray-500">
                         Uploaded {new Date(file.uploaded_at).toLocaleString()}
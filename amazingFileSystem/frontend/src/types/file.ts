@@ -7,7 +7,7 @@ export interface File {
   file: string;
   reference_count: number;
   storage_saved: number;
-  storage_saved_formatted: string;
+  storage_saved_formatted?: string;  // Not included in list responses
 }
 
 export interface FileReference {